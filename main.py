@@ -1,14 +1,19 @@
 import os
-import shutil
 import tempfile
 import warnings
 import traceback
 import base64
-from typing import List, Dict, Any
+import uuid
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Optional
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
@@ -27,7 +32,7 @@ load_dotenv()
 app = FastAPI(
     title="Tax Document Processing API",
     description="An API to upload and process tax documents, calculate tax liability, and generate a filled Form 1040.",
-    version="1.3.0"
+    version="1.4.0"
 )
 
 # --- Add CORS Middleware ---
@@ -66,7 +71,37 @@ class TaxSummary(BaseModel):
 class ProcessingResult(BaseModel):
     parsed_forms: List[ParsedForm]
     tax_summary: TaxSummary
-    filled_pdf_base64: str
+    pdf_token: Optional[str] = None
+    filled_pdf_base64: Optional[str] = None
+
+# --- Filled PDF Cache ---
+# Filled PDFs are kept in memory and downloaded separately instead of being base64-embedded in the JSON.
+# Entries hold SSNs, so each one is handed out once and expires after PDF_CACHE_TTL_SECONDS even if never
+# fetched. The cache lives in this process only: with several uvicorn workers or Fly machines
+# (auto_start_machines) the download can land on another instance and 404; send inline_pdf=true there.
+PDF_CACHE_SIZE = 64
+PDF_CACHE_TTL_SECONDS = 300
+_pdf_cache: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+def _evict_expired_pdfs(now: float) -> None:
+    # Every entry gets the same TTL, so insertion order is also expiry order.
+    while _pdf_cache and next(iter(_pdf_cache.values()))[0] <= now:
+        _pdf_cache.popitem(last=False)
+
+def _store_pdf(pdf_bytes: bytes) -> str:
+    now = time.monotonic()
+    _evict_expired_pdfs(now)
+    token = uuid.uuid4().hex
+    _pdf_cache[token] = (now + PDF_CACHE_TTL_SECONDS, pdf_bytes)
+    while len(_pdf_cache) > PDF_CACHE_SIZE:
+        _pdf_cache.popitem(last=False)
+    return token
+
+def _take_pdf(token: str) -> Optional[bytes]:
+    """Removes and returns the cached PDF for token, or None if it is unknown, expired, or already downloaded."""
+    _evict_expired_pdfs(time.monotonic())
+    entry = _pdf_cache.pop(token, None)
+    return entry[1] if entry else None
 
 # --- Helper Functions ---
 def _to_float(s: Any) -> float:
@@ -74,10 +109,17 @@ def _to_float(s: Any) -> float:
     try: return float(str(s).replace(",", "").replace("$", ""))
     except (ValueError, TypeError): return 0.0
 
-def aggregate_and_compute(parsed_results: List[Dict], filing_status: str, num_children: int, num_dependents: int) -> Dict:
-    w2_fields = next((r["parsed_fields"] for r in parsed_results if r["document_type"] == "W-2"), {})
-    int_fields = next((r["parsed_fields"] for r in parsed_results if r["document_type"] == "1099-INT"), {})
-    nec_fields = next((r["parsed_fields"] for r in parsed_results if r["document_type"] == "1099-NEC"), {})
+def group_by_type(parsed_results: List[Dict]) -> Dict[str, Dict]:
+    """Maps each document type to the parsed fields of its first occurrence."""
+    by_type = {}
+    for r in parsed_results:
+        by_type.setdefault(r["document_type"], r["parsed_fields"])
+    return by_type
+
+def aggregate_and_compute(by_type: Dict[str, Dict], filing_status: str, num_children: int, num_dependents: int) -> Dict:
+    w2_fields = by_type.get("W-2", {})
+    int_fields = by_type.get("1099-INT", {})
+    nec_fields = by_type.get("1099-NEC", {})
     w2_income = _to_float(w2_fields.get("Box 1: Wages, tips, other compensation", "0"))
     w2_withheld = _to_float(w2_fields.get("Box 2: Federal income tax withheld", "0"))
     int_income = _to_float(int_fields.get("Box 1: Interest income", "0"))
@@ -92,26 +134,38 @@ def aggregate_and_compute(parsed_results: List[Dict], filing_status: str, num_ch
         num_qualifying_children=num_children, num_other_dependents=num_dependents
     )
 
-def blocking_file_processor(files: List[UploadFile], openai_api_key: str) -> List[Dict]:
+def _prepare_one(index: int, file_name: str, data: bytes, temp_dir: str, parser: TaxFormParser) -> Tuple[Dict, str]:
+    """Writes one upload to disk and classifies it; returns its result row and the context still to be extracted."""
+    try:
+        # Prefix with the upload index so uploads sharing a filename never overwrite each other.
+        file_path = os.path.join(temp_dir, f"{index}_{os.path.basename(file_name)}")
+        Path(file_path).write_bytes(data)
+        doc_type, context = parser.prepare_pdf(file_path)
+        return {"file": file_name, "document_type": doc_type, "parsed_fields": {}}, context
+    except Exception as e:
+        traceback.print_exc()
+        return {"file": file_name, "document_type": "Error", "parsed_fields": {"error": str(e)}}, ""
+
+def blocking_file_processor(file_payloads: List[Tuple[str, bytes]], openai_api_key: str) -> List[Dict]:
     parser = TaxFormParser(openai_api_key=openai_api_key)
-    parsed_results = []
+    if not file_payloads: return []
     with tempfile.TemporaryDirectory() as temp_dir:
-        for file in files:
-            try:
-                file_path = os.path.join(temp_dir, file.filename)
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                res = parser.process_pdf(file_path)
-                # The type hint for res in silent.py's process_pdf is now `tuple[Dict[str, Any], str]`
-                if isinstance(res, tuple) and len(res) == 2:
-                    parsed_dict, doc_type = res
-                else:
-                    parsed_dict, doc_type = res or {}, "Unknown"
-                parsed_results.append({"file": file.filename, "document_type": doc_type, "parsed_fields": parsed_dict})
-            except Exception as e:
-                traceback.print_exc()
-                parsed_results.append({"file": file.filename, "document_type": "Error", "parsed_fields": {"error": str(e)}})
-    return parsed_results
+        # OCR is I/O-bound on the Tesseract subprocess, so threads let the files overlap their waits.
+        with ThreadPoolExecutor(max_workers=min(8, len(file_payloads))) as ex:
+            prepared = list(ex.map(
+                lambda item: _prepare_one(item[0], item[1][0], item[1][1], temp_dir, parser),
+                enumerate(file_payloads)
+            ))
+    # Every document goes to OpenAI in one request instead of one round trip each.
+    pending = [(row, context) for row, context in prepared if context]
+    try:
+        extracted = parser.extract_batch([(row["document_type"], context) for row, context in pending])
+    except Exception as e:
+        traceback.print_exc()
+        extracted = [{"error": str(e)} for _ in pending]
+    for (row, _), fields in zip(pending, extracted):
+        row["parsed_fields"] = fields
+    return [row for row, _ in prepared]
 
 # --- API Endpoint ---
 @app.post("/process-forms/", response_model=ProcessingResult)
@@ -119,28 +173,36 @@ async def process_tax_forms(
     filing_status: str = Form(...),
     num_qualifying_children: int = Form(0),
     num_other_dependents: int = Form(0),
+    inline_pdf: bool = Form(False),
     files: List[UploadFile] = File(...)
 ):
     openai_api_key = os.getenv("OPENAI_API_KEY")
     if not openai_api_key:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY not found in environment variables.")
 
+    # Read uploads asynchronously so the worker thread only does OCR/AI work.
+    file_payloads = [(f.filename, await f.read()) for f in files]
     parsed_results = await run_in_threadpool(
         blocking_file_processor,
-        files=files,
+        file_payloads=file_payloads,
         openai_api_key=openai_api_key
     )
 
+    by_type = group_by_type(parsed_results)
     try:
-        tax_summary = aggregate_and_compute(parsed_results, filing_status, num_qualifying_children, num_other_dependents)
+        tax_summary = aggregate_and_compute(by_type, filing_status, num_qualifying_children, num_other_dependents)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"An error occurred during tax calculation: {e}")
     
-    w2_data = next((r["parsed_fields"] for r in parsed_results if r["document_type"] == "W-2"), {})
+    w2_data = by_type.get("W-2", {})
+    # Split once; everything before the last token (first name plus any middle names) goes in the first-name box.
+    name_parts = str(w2_data.get("Employee Name") or "").split()
+    first_name = " ".join(name_parts[:-1]) if len(name_parts) > 1 else "".join(name_parts)
+    last_name = name_parts[-1] if len(name_parts) > 1 else ""
     pdf_data_to_fill = {
-        "Your first name and middle initial": w2_data.get("Employee Name", " ").split(' ')[0],
-        "Last name": w2_data.get("Employee Name", " ").split(' ')[-1],
+        "Your first name and middle initial": first_name,
+        "Last name": last_name,
         "Your social security number": w2_data.get("Employee Social Security Number (SSN)", ""),
         f"Filing Status - {filing_status.replace('_', ' ').title()}": True,
         '1a - Wages from Form(s) W-2': tax_summary['total_income'],
@@ -159,12 +221,20 @@ async def process_tax_forms(
     input_pdf_template = "f1040.pdf" 
     filled_pdf_bytes = fill_1040_pdf(input_pdf_template, pdf_data_to_fill)
     
+    result = {"parsed_forms": parsed_results, "tax_summary": tax_summary}
     if filled_pdf_bytes:
-        pdf_base64_string = base64.b64encode(filled_pdf_bytes).decode('utf-8')
-    else:
-        pdf_base64_string = ""
-
-    return {"parsed_forms": parsed_results, "tax_summary": tax_summary, "filled_pdf_base64": pdf_base64_string}
+        result["pdf_token"] = _store_pdf(filled_pdf_bytes)
+        # Older clients can still ask for the PDF embedded in the response.
+        if inline_pdf:
+            result["filled_pdf_base64"] = base64.b64encode(filled_pdf_bytes).decode('utf-8')
+    return result
+
+@app.get("/process-forms/{token}/pdf", response_class=Response)
+async def download_filled_pdf(token: str):
+    pdf_bytes = _take_pdf(token)
+    if pdf_bytes is None:
+        raise HTTPException(status_code=404, detail="Filled PDF not found or expired.")
+    return Response(pdf_bytes, media_type="application/pdf", headers={"Content-Disposition": 'attachment; filename="f1040_filled.pdf"'})
 
 @app.get("/", include_in_schema=False)
 async def root():
@@ -1,18 +1,38 @@
 import os
 import re
 import fitz  # PyMuPDF
-from pdf22image import convert_from_path
 import pytesseract
+from PIL import Image
 from unstructured.partition.pdf import partition_pdf
 import openai
+import httpx
 import json
+import orjson
 import warnings
 import traceback
 import tempfile
-from typing import Union, Dict, Any # Added Union and other types for clarity
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Dict, Any, List # Added Union and other types for clarity
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+# Below this many characters the cached page text is too sparse to send to the LLM as-is.
+MIN_CONTEXT_CHARS = 200
+
+# LSTM-only engine with a single-uniform-block layout: faster than the auto-segmenting default on dense forms.
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+
+# Process-wide OCR pool: one Tesseract process per core across all files being processed.
+# Tesseract is OpenMP-threaded itself; the Dockerfile sets OMP_THREAD_LIMIT=1 to avoid oversubscription.
+_OCR_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="ocr")
+
+# One OpenAI client per API key, shared by every parser so requests reuse its connection pool.
+OPENAI_MAX_RETRIES = 2
+OPENAI_MAX_CONNECTIONS = 20
+_OPENAI_CLIENTS: Dict[str, openai.OpenAI] = {}
+_OPENAI_CLIENTS_LOCK = threading.Lock()
+
 class TaxFormParser:
     """
     A class to parse tax documents, identify their type, and extract
@@ -28,17 +48,38 @@ class TaxFormParser:
         
         self.client = self._initialize_openai_client(openai_api_key)
         self.form_field_defs = self._get_form_field_definitions()
+        self._page_texts_cache: Dict[tuple, List[str]] = {}
+        # 1-based numbers of the pages that had no text layer and were OCR'd, keyed like _page_texts_cache.
+        self._ocr_pages_cache: Dict[tuple, set] = {}
+        # Compile the classification patterns once instead of on every page scan.
+        doc_type_patterns = self._get_doc_type_patterns()
+        self._doc_type_res: Dict[str, List[re.Pattern]] = {
+            dt: [re.compile(p, re.IGNORECASE) for p in pats] for dt, pats in doc_type_patterns.items()
+        }
+        self._header_res: Dict[str, re.Pattern] = {dt: res[0] for dt, res in self._doc_type_res.items()}
+        self._cue_res: Dict[str, List[re.Pattern]] = {
+            dt: [re.compile(c, re.IGNORECASE) for c in cues] for dt, cues in self._get_cue_definitions().items()
+        }
 
     def _initialize_openai_client(self, api_key: str):
-        """Initializes and returns the OpenAI client."""
+        """Returns the shared OpenAI client for this API key, creating it on first use."""
         if not api_key:
             print("WARNING: OpenAI API key is missing. AI extraction will be skipped.")
             return None
-        try:
-            return openai.OpenAI(api_key=api_key)
-        except Exception as e:
-            print(f"ERROR: Failed to initialize OpenAI client: {e}")
-            return None
+        with _OPENAI_CLIENTS_LOCK:
+            client = _OPENAI_CLIENTS.get(api_key)
+            if client is not None: return client
+            try:
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=openai.DefaultHttpxClient(limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS)),
+                )
+            except Exception as e:
+                print(f"ERROR: Failed to initialize OpenAI client: {e}")
+                return None
+            _OPENAI_CLIENTS[api_key] = client
+            return client
 
     def _get_form_field_definitions(self) -> Dict[str, Any]: # Changed type hint
         """Returns the dictionary of field definitions for supported tax forms."""
@@ -70,57 +111,100 @@ class TaxFormParser:
             },
         }
 
-    def _parse_text_from_page(self, file_path: str, page_number: int) -> str:
-        """Parses a single page of a PDF using Tesseract OCR."""
+    def _rasterize_pages(self, doc: fitz.Document, page_numbers: List[int]) -> List[Image.Image]:
+        """Renders the given pages of an already-open PDF to images in a single pass."""
+        images = []
+        for page_num in page_numbers:
+            pix = doc[page_num - 1].get_pixmap(dpi=150) # Reduce DPI
+            images.append(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+        return images
+
+    def _parse_text_from_page(self, image: Image.Image, page_number: int) -> str:
+        """Parses a single rasterized PDF page using Tesseract OCR."""
         try:
-            images = convert_from_path(file_path, first_page=page_number, last_page=page_number, dpi=150) # Reduce DPI
-            if not images: return ""
-            return pytesseract.image_to_string(images[0])
+            return pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
         except Exception as e:
-            print(f"ERROR: Tesseract OCR failed for page {page_number} of {file_path}. Error: {e}")
+            print(f"ERROR: Tesseract OCR failed for page {page_number}. Error: {e}")
             return ""
 
-    def _identify_document_type(self, file_path: str) -> Union[str, None]: # Changed type hint
-        doc_type_patterns = {
+    def _ocr_all_pages(self, images: List[Image.Image], page_numbers: List[int]) -> List[str]:
+        """OCRs the rasterized pages concurrently; Tesseract runs as a subprocess, so threads scale."""
+        # Every file's pages share one pool so concurrent uploads can't start more Tesseract processes than cores.
+        return list(_OCR_EXECUTOR.map(self._parse_text_from_page, images, page_numbers))
+
+    def _page_texts(self, file_path: str) -> List[str]:
+        """
+        Returns the text of every page in the PDF, read once and cached.
+        Uses the embedded text layer and only falls back to OCR for image-only pages.
+        """
+        cache_key = (file_path, os.path.getmtime(file_path))
+        cached = self._page_texts_cache.get(cache_key)
+        if cached is not None: return cached
+        try:
+            with fitz.open(file_path) as doc:
+                texts = [page.get_text("text") for page in doc]
+                ocr_pages = [i for i, text in enumerate(texts, 1) if not text.strip()]
+                if ocr_pages:
+                    images = self._rasterize_pages(doc, ocr_pages)
+                    for page_num, text in zip(ocr_pages, self._ocr_all_pages(images, ocr_pages)):
+                        texts[page_num - 1] = text
+        except Exception as e:
+            print(f"ERROR: Failed to read pages of {file_path}. Error: {e}")
+            return []
+        self._page_texts_cache[cache_key] = texts
+        self._ocr_pages_cache[cache_key] = set(ocr_pages)
+        return texts
+
+    def _is_ocr_page(self, file_path: str, page_number: int) -> bool:
+        """Whether the page's cached text came from OCR rather than an embedded text layer."""
+        self._page_texts(file_path)
+        return page_number in self._ocr_pages_cache.get((file_path, os.path.getmtime(file_path)), set())
+
+    def _get_doc_type_patterns(self) -> Dict[str, List[str]]:
+        """Returns the regex patterns used to identify each document type; the first is the form header."""
+        return {
             "W-2": [r"Form\s*W-2", r"Wage\s+and\s+Tax\s+Statement", r"Wages,\s+tips,\s+other\s+compensation"],
             "1099-INT": [r"Form\s*1099-INT", r"Interest\s+Income", r"Early\s+withdrawal\s+penalty"],
             "1099-NEC": [r"Form\s*1099-NEC", r"Nonemployee\s+Compensation", r"Payer's\s+TIN"],
         }
-        header_patterns = {dt: pats[0] for dt, pats in doc_type_patterns.items()}
-        scores = {dt: 0 for dt in doc_type_patterns}
-        try:
-            with fitz.open(file_path) as doc:
-                for page_num in range(1, len(doc) + 1):
-                    text = self._parse_text_from_page(file_path, page_num)
-                    if not text: continue
-                    for dt, header_pat in header_patterns.items():
-                        if re.search(header_pat, text, re.IGNORECASE): return dt
-                    for dt, patterns in doc_type_patterns.items():
-                        for pat in patterns:
-                            if re.search(pat, text, re.IGNORECASE): scores[dt] += 1
-        except Exception: return None
-        best = max(scores, key=scores.get)
-        return best if scores[best] > 0 else None
-
-    def _find_page_with_cues(self, file_path: str, doc_type: str) -> Union[int, None]: # Changed type hint
-        cue_definitions = {
+
+    def _get_cue_definitions(self) -> Dict[str, List[str]]:
+        """Returns the cues used to locate the data-bearing page of each document type."""
+        return {
             "W-2": ["Wages, tips, other compensation", "Federal income tax withheld", "Wage and Tax Statement"],
             "1099-INT": ["Interest Income", "Payer's TIN", "Early withdrawal penalty"],
             "1099-NEC": ["Nonemployee Compensation", "Payer's TIN", "Federal income tax withheld"]
         }
-        cues = cue_definitions.get(doc_type)
-        if not cues: return None
-        best_page, max_score = None, 0
-        try:
-            with fitz.open(file_path) as doc:
-                for i in range(1, len(doc) + 1):
-                    text = self._parse_text_from_page(file_path, i)
-                    if not text: continue
-                    score = sum(bool(re.search(cue, text, re.IGNORECASE)) for cue in cues)
-                    if score > max_score:
-                        max_score, best_page = score, i
-        except Exception: return None
-        return best_page if max_score > 0 else None
+
+    def _classify_and_locate(self, file_path: str) -> tuple[Union[str, None], Union[int, None]]:
+        """
+        Identifies the document type and the page holding its data in a single pass
+        over the page texts, scoring type patterns and cues for every type at once.
+        """
+        header_type, header_page, header_page_has_cues = None, None, False
+        type_scores = {dt: 0 for dt in self._doc_type_res}
+        best_cue_page, best_cue_score = {}, {dt: 0 for dt in self._cue_res}
+        for page_num, text in enumerate(self._page_texts(file_path), 1):
+            if not text: continue
+            if header_type is None:
+                header_type = next((dt for dt, header_re in self._header_res.items() if header_re.search(text)), None)
+                if header_type: header_page = page_num
+            for dt, regexes in self._doc_type_res.items():
+                type_scores[dt] += sum(1 for rx in regexes if rx.search(text))
+            for dt, cue_res in self._cue_res.items():
+                score = sum(1 for rx in cue_res if rx.search(text))
+                if page_num == header_page and dt == header_type: header_page_has_cues = score > 0
+                if score > best_cue_score[dt]:
+                    best_cue_score[dt], best_cue_page[dt] = score, page_num
+
+        if header_type:
+            doc_type = header_type
+            # The header page is the data page unless it carries none of the cues (e.g. an instructions sheet).
+            if header_page_has_cues: return doc_type, header_page
+        else:
+            doc_type = max(type_scores, key=type_scores.get)
+            if not type_scores[doc_type]: return None, None
+        return doc_type, best_cue_page.get(doc_type)
 
     def _create_temp_pdf(self, source_path: str, page_number: int, output_path: str):
         with fitz.open(source_path) as src, fitz.open() as dst:
@@ -150,32 +234,89 @@ class TaxFormParser:
                 response_format={"type": "json_object"},
                 messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
             )
-            return json.loads(resp.choices[0].message.content)
+            return orjson.loads(resp.choices[0].message.content)
         except Exception as e:
             print(f"ERROR: OpenAI data extraction failed: {e}")
             traceback.print_exc()
             return {}
 
-    def process_pdf(self, file_path: str) -> tuple[Dict[str, Any], str]: # Changed type hint
-        if not self.client or not os.path.exists(file_path): return {}, "Error"
-        doc_type = self._identify_document_type(file_path)
-        if not doc_type: return {}, "Unknown"
-        page = self._find_page_with_cues(file_path, doc_type)
-        if not page: return {}, doc_type
-        
-        temp_pdf = os.path.join(tempfile.gettempdir(), "_temp_page.pdf")
+    def extract_batch(self, contexts: List[tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Extracts fields for several (doc_type, context) pairs with a single OpenAI call.
+        Returns one dict per input, in order. Falls back to one call per document if the
+        batched response cannot be used.
+        """
+        if not contexts: return []
+        if len(contexts) == 1: return [self._extract_data_with_openai(contexts[0][1], contexts[0][0])]
+        if not self.client: return [{} for _ in contexts]
+        doc_types = list(dict.fromkeys(dt for dt, _ in contexts if dt in self.form_field_defs))
+        instructions = "\n".join(
+            f"{dt}:\n" + "\n".join(f"- **{fld}**: {loc}" for fld, loc in self.form_field_defs[dt].items())
+            for dt in doc_types
+        )
+        system_prompt = f"You are an expert AI assistant extracting structured data from US tax forms. Use these definitions per document type:\n{instructions}\nReturn one JSON object with a key per document (e.g. \"document_1\"), each mapping to an object of that document's fields. If a value is not found, use 'N/A'."
+        documents = "\n\n".join(
+            f"DOCUMENT_{i} ({dt}):\nCONTEXT:\n---\n{context}\n---\nFIELDS_TO_EXTRACT:\n{json.dumps(list(self.form_field_defs.get(dt, {})), indent=2)}"
+            for i, (dt, context) in enumerate(contexts, 1)
+        )
+        user_prompt = f"Extract values for the listed fields from each of these documents:\n\n{documents}"
         try:
-            self._create_temp_pdf(file_path, page, temp_pdf)
-            context = self._process_file_with_unstructured(temp_pdf)
-            if not context: return {}, doc_type
-            return self._extract_data_with_openai(context, doc_type), doc_type
+            resp = self.client.chat.completions.create(
+                model="gpt-4o",
+                response_format={"type": "json_object"},
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+            )
+            # The prompt labels documents DOCUMENT_i; accept the reply keys in either case.
+            batch = {str(k).lower(): v for k, v in orjson.loads(resp.choices[0].message.content).items()}
+            results = [batch.get(f"document_{i}") for i in range(1, len(contexts) + 1)]
+            if all(isinstance(r, dict) for r in results): return results
+            print("WARNING: Batched OpenAI response was missing documents; extracting individually.")
         except Exception as e:
-            print(f"ERROR: General PDF processing failed for {file_path}: {e}")
+            print(f"ERROR: Batched OpenAI data extraction failed: {e}")
             traceback.print_exc()
-            return {}, "Error"
+        # Fall back to one call per document, run concurrently so the retry costs one round trip rather than N.
+        with ThreadPoolExecutor(max_workers=min(8, len(contexts))) as ex:
+            return list(ex.map(lambda item: self._extract_data_with_openai(item[1], item[0]), contexts))
+
+    def _extract_context_from_page_pdf(self, file_path: str, page_number: int) -> str:
+        """Copies the page into its own PDF and runs unstructured on it; the slow path for sparse scanned pages."""
+        # Unique per call so concurrent process_pdf calls never clobber each other's page.
+        fd, temp_pdf = tempfile.mkstemp(suffix="_temp_page.pdf")
+        os.close(fd)
+        try:
+            self._create_temp_pdf(file_path, page_number, temp_pdf)
+            return self._process_file_with_unstructured(temp_pdf)
         finally:
             if os.path.exists(temp_pdf):
                 try:
                     os.remove(temp_pdf)
                 except OSError as e:
-                    print(f"WARNING: Could not remove temporary file {temp_pdf}: {e}")
\ No newline at end of file
+                    print(f"WARNING: Could not remove temporary file {temp_pdf}: {e}")
+
+    def prepare_pdf(self, file_path: str) -> tuple[str, str]:
+        """
+        Classifies the PDF and returns (document_type, context) ready for extraction.
+        The context is empty when there is nothing to send to OpenAI.
+        """
+        if not self.client or not os.path.exists(file_path): return "Error", ""
+        doc_type, page = self._classify_and_locate(file_path)
+        if not doc_type: return "Unknown", ""
+        if not page: return doc_type, ""
+        
+        try:
+            # The page text read during classification is usually enough context on its own.
+            # Only a sparse OCR result is worth the heavyweight unstructured pass; a text-layer page
+            # would just yield the same text again. A failed slow path keeps the short OCR text.
+            context = self._page_texts(file_path)[page - 1]
+            if len(context.strip()) < MIN_CONTEXT_CHARS and self._is_ocr_page(file_path, page):
+                context = self._extract_context_from_page_pdf(file_path, page) or context
+            return doc_type, context
+        except Exception as e:
+            print(f"ERROR: General PDF processing failed for {file_path}: {e}")
+            traceback.print_exc()
+            return "Error", ""
+
+    def process_pdf(self, file_path: str) -> tuple[Dict[str, Any], str]: # Changed type hint
+        doc_type, context = self.prepare_pdf(file_path)
+        if not context: return {}, doc_type
+        return self._extract_data_with_openai(context, doc_type), doc_type
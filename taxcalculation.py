@@ -3,6 +3,9 @@
 # This script implements a comprehensive tax calculation logic for the 2024 tax year.
 # It includes standard deductions, adjustments to income, and tax credits for dependents.
 
+import bisect
+import numpy as np
+
 # --- Constants for Tax Year 2024 ---
 
 TAX_BRACKETS_2024 = {
@@ -37,14 +40,41 @@ STANDARD_DEDUCTION_2024 = {
 CHILD_TAX_CREDIT_AMOUNT = 2000
 CREDIT_FOR_OTHER_DEPENDENTS_AMOUNT = 500
 
+# --- Bracket tables stacked per filing status for the batch API ---
+_STATUS_KEYS = list(TAX_BRACKETS_2024)
+_STATUS_INDEX = {status: i for i, status in enumerate(_STATUS_KEYS)}
+_BRACKET_LOWERS = np.array([[b[0] for b in TAX_BRACKETS_2024[s]] for s in _STATUS_KEYS], dtype=np.float64)
+_BRACKET_UPPERS = np.array([[b[1] for b in TAX_BRACKETS_2024[s]] for s in _STATUS_KEYS], dtype=np.float64)
+_BRACKET_RATES = np.array([[b[2] for b in TAX_BRACKETS_2024[s]] for s in _STATUS_KEYS], dtype=np.float64)
+_STATUS_DEDUCTIONS = np.array([STANDARD_DEDUCTION_2024.get(s, 14600) for s in _STATUS_KEYS], dtype=np.float64)
+
+def _build_bracket_table(brackets):
+    """
+    Collapses a bracket list into (thresholds, cumulative tax at each threshold, rates)
+    so the tax for any income is one lookup plus one multiply.
+    """
+    thresholds, cumtax, rates = [], [], []
+    tax_so_far = 0.0
+    for lower, upper, rate in brackets:
+        thresholds.append(lower)
+        cumtax.append(tax_so_far)
+        rates.append(rate)
+        tax_so_far += (upper - lower) * rate
+    return thresholds, cumtax, rates
+
+_BRACKET_TABLE = {status: _build_bracket_table(brackets) for status, brackets in TAX_BRACKETS_2024.items()}
+
+def _bracketed_tax_from_table(taxable_income, bracket_table):
+    """Closed-form bracketed tax given a table from _build_bracket_table."""
+    if taxable_income <= 0:
+        return 0
+    thresholds, cumtax, rates = bracket_table
+    idx = bisect.bisect_left(thresholds, taxable_income) - 1
+    return round(cumtax[idx] + (taxable_income - thresholds[idx]) * rates[idx], 2)
+
 def compute_bracketed_tax(taxable_income, brackets):
     """Calculates tax based on progressive tax brackets."""
-    tax = 0
-    for lower, upper, rate in brackets:
-        if taxable_income > lower:
-            amount_in_bracket = min(taxable_income, upper) - lower
-            tax += amount_in_bracket * rate
-    return round(tax, 2)
+    return _bracketed_tax_from_table(taxable_income, _build_bracket_table(brackets))
 
 def calculate_tax_liability(
     filing_status, w2_income=0, w2_withheld=0, int_income=0, int_withheld=0,
@@ -63,10 +93,10 @@ def calculate_tax_liability(
     deduction = STANDARD_DEDUCTION_2024.get(status_key, 14600)
     taxable_income = max(0, adjusted_income - deduction)
     
-    brackets = TAX_BRACKETS_2024.get(status_key)
-    if not brackets:
+    bracket_table = _BRACKET_TABLE.get(status_key)
+    if not bracket_table:
         raise ValueError(f"Unknown filing status for tax calculation: {filing_status}")
-    initial_tax = compute_bracketed_tax(taxable_income, brackets)
+    initial_tax = _bracketed_tax_from_table(taxable_income, bracket_table)
     
     child_tax_credit = num_qualifying_children * CHILD_TAX_CREDIT_AMOUNT
     other_dependents_credit = num_other_dependents * CREDIT_FOR_OTHER_DEPENDENTS_AMOUNT
@@ -90,3 +120,55 @@ def calculate_tax_liability(
         "total_credits": total_credits, "final_tax_liability": final_tax_liability,
         "total_withheld": total_withheld, "tax_due": balance_due, "refund": refund
     }
+
+def compute_bracketed_tax_batch(taxable_income, status_idx):
+    """Vectorized compute_bracketed_tax over arrays of taxable income and filing-status indices."""
+    taxable_income = np.asarray(taxable_income, dtype=np.float64)[:, None]
+    lowers, uppers, rates = _BRACKET_LOWERS[status_idx], _BRACKET_UPPERS[status_idx], _BRACKET_RATES[status_idx]
+    amount_in_bracket = np.clip(np.minimum(taxable_income, uppers) - lowers, 0, None)
+    return np.round((amount_in_bracket * rates).sum(axis=1), 2)
+
+def calculate_tax_liability_batch(
+    filing_status, w2_income=0, w2_withheld=0, int_income=0, int_withheld=0,
+    nec_income=0, nec_withheld=0, early_withdrawal_penalty=0,
+    num_qualifying_children=0, num_other_dependents=0,
+):
+    """
+    Batch version of calculate_tax_liability for many taxpayers at once.
+    filing_status is a sequence of statuses; every other argument is an array
+    (or scalar, broadcast) aligned with it. Returns a dictionary of arrays with
+    the same keys as calculate_tax_liability.
+    """
+    status_keys = [str(fs).lower().replace(" ", "_") for fs in np.atleast_1d(filing_status)]
+    unknown = [fs for fs in status_keys if fs not in _STATUS_INDEX]
+    if unknown:
+        raise ValueError(f"Unknown filing status for tax calculation: {unknown[0]}")
+    status_idx = np.array([_STATUS_INDEX[fs] for fs in status_keys], dtype=np.intp)
+    n = len(status_idx)
+
+    def _arr(x):
+        return np.broadcast_to(np.asarray(x, dtype=np.float64), (n,))
+
+    total_income = _arr(w2_income) + _arr(int_income) + _arr(nec_income)
+    total_adjustments = _arr(early_withdrawal_penalty)
+    adjusted_income = total_income - total_adjustments
+
+    deduction = _STATUS_DEDUCTIONS[status_idx]
+    taxable_income = np.maximum(0, adjusted_income - deduction)
+    initial_tax = compute_bracketed_tax_batch(taxable_income, status_idx)
+
+    total_credits = (_arr(num_qualifying_children) * CHILD_TAX_CREDIT_AMOUNT
+                     + _arr(num_other_dependents) * CREDIT_FOR_OTHER_DEPENDENTS_AMOUNT)
+    final_tax_liability = np.maximum(0, initial_tax - total_credits)
+
+    total_withheld = _arr(w2_withheld) + _arr(int_withheld) + _arr(nec_withheld)
+    balance_due = np.round(np.maximum(0, final_tax_liability - total_withheld), 2)
+    refund = np.round(np.maximum(0, total_withheld - final_tax_liability), 2)
+
+    return {
+        "total_income": total_income, "adjustments": total_adjustments,
+        "adjusted_gross_income": adjusted_income, "standard_deduction": deduction,
+        "taxable_income": taxable_income, "initial_tax_liability": initial_tax,
+        "total_credits": total_credits, "final_tax_liability": final_tax_liability,
+        "total_withheld": total_withheld, "tax_due": balance_due, "refund": refund
+    }